@@ -1,24 +1,40 @@
 #!/usr/bin/env python3
 """
 Smart PyPI Proxy Server that auto-detects required versions.
-Usage: python pypi_proxy.py [--analyze package_name]
+Usage: python pypi_proxy.py [--verbose] [--analyze package_name]
 """
 
-from http.server import HTTPServer, BaseHTTPRequestHandler
-import urllib.request
-import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 import json
+import io
 import tempfile
 import os
 import shutil
+import socket
 import re
 import sys
+import threading
 import zipfile
 import hashlib
+import logging
 import base64
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
+import urllib3
+from packaging.requirements import InvalidRequirement, Requirement
 from packaging.specifiers import SpecifierSet
-from packaging.version import Version
+from packaging.version import InvalidVersion, Version
+
+# orjson parses the multi-megabyte PyPI payloads several times faster and
+# serializes cache entries straight to bytes
+try:
+    from orjson import dumps as json_dumps, loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+    def json_dumps(obj):
+        return json.dumps(obj).encode('utf-8')
 
 # IMPORTANT: Only add packages HERE that you want to REPLACE with dummy versions
 DUMMY_PACKAGES = {
@@ -27,81 +43,352 @@ DUMMY_PACKAGES = {
     'torchaudio': 'auto',
 }
 
+_UNDERSCORE_TRANS = str.maketrans('_', '-')
+
+
+def _normalize_name(name):
+    """Lowercase a package name and use hyphens for underscores (PEP 503)."""
+    return name.lower().translate(_UNDERSCORE_TRANS)
+
+
+# DUMMY_PACKAGES keyed by normalized name; all lookups go through this so
+# 'Foo_Bar' in the config matches requests for foo-bar
+_DUMMY_SPECS = {_normalize_name(k): v for k, v in DUMMY_PACKAGES.items()}
+
 PYPI_INDEX = "https://pypi.org"
+USER_AGENT = 'pypi-proxy/1.0'
+
+# Per-request tracing is logged at DEBUG; set PYPI_PROXY_LOG=DEBUG (or pass
+# --verbose) to see it. Problems are logged at WARNING and above.
+log = logging.getLogger("pypi_proxy")
+_log_level = (os.environ.get('PYPI_PROXY_LOG') or 'WARNING').upper()
+# getLevelName() maps registered level names to their number (the same table
+# as getLevelNamesMapping(), which only exists on 3.11+)
+if isinstance(logging.getLevelName(_log_level), int):
+    log.setLevel(_log_level)
+else:
+    log.setLevel(logging.WARNING)
+    log.warning("Unknown PYPI_PROXY_LOG level %r, using WARNING", _log_level)
+
 VERSION_CACHE = {}
 METADATA_CACHE = {}
+WHEEL_CACHE = {}  # (package, version, include_deps) -> wheel bytes
+# Versions come from client URLs, so bound the cache; oldest builds go first
+WHEEL_CACHE_MAX = 512
+_WHEEL_CACHE_LOCK = threading.Lock()
+CACHE_DIR = Path.home() / '.cache' / 'pypi_proxy'
+SIMPLE_JSON_CONTENT_TYPE = 'application/vnd.pypi.simple.v1+json'
+SDIST_EXTENSIONS = ('.tar.gz', '.zip')
+
+# Package name and version from a {name}-{version}-py3-none-any.whl filename
+# Versions are limited to PEP 440 characters: they are substituted unescaped
+# into the generated __init__.py and direct_url.json
+_WHL_NAME_RE = re.compile(r'([a-zA-Z0-9_-]+)-\d')
+_WHL_VER_RE = re.compile(r'-(\d+\.\d+\.\d+[a-zA-Z0-9_.!+]*)-')
+# Filenames in a PEP 503 HTML simple page
+_HTML_LINK_TEXT_RE = re.compile(r'<a\b[^>]*>([^<]+)</a>')
+# Runs of separators collapsed by PEP 503 name normalization
+_NORMALIZE_RE = re.compile(r'[-_.]+')
+# First character after the project name in a requirement string
+_DEP_SPLIT_RE = re.compile(r'[\s\[\]()<>=!~;]')
+# Canonical PEP 440 release strings (no epoch or local part)
+_CANON_VER = re.compile(r'\d+(?:\.\d+)*(?:(?:a|b|rc)\d+)?(?:\.post\d+)?(?:\.dev\d+)?')
+
+# Keep-alive connections to PyPI shared by all upstream requests. The index
+# URL is parsed once here so request handlers only ever pass a path.
+# urllib3 only falls back to a pool's headers when a request passes none,
+# so callers start from _UPSTREAM.headers to keep the User-Agent.
+_POOL = urllib3.PoolManager(maxsize=32, retries=False)
+_UPSTREAM = _POOL.connection_from_url(
+    PYPI_INDEX, pool_kwargs={'headers': {'User-Agent': USER_AGENT}},
+)
+_UPSTREAM_PREFIX = (urllib3.util.parse_url(PYPI_INDEX).path or '').rstrip('/')
+
+# Metadata lookups are idempotent, so retry transient failures and follow
+# PyPI's redirects to canonical project names. Proxied traffic is not retried.
+_API_RETRIES = urllib3.Retry(3, backoff_factor=0.3)
+
+# Chunk size for relaying proxied bodies; large chunks keep multi-MB wheels
+# to a handful of read/write round trips through Python
+PROXY_COPY_BUFSIZE = 1 << 20
+
+# Minimum kernel send buffer per client connection, so a good part of each
+# PROXY_COPY_BUFSIZE chunk is in flight before sendall() blocks. Linux
+# autotunes the buffer up to net.ipv4.tcp_wmem's max (4 MiB by default) and
+# setting SO_SNDBUF would turn that off, so there it is left alone.
+SOCKET_SNDBUF = 256 * 1024
+_TUNE_SNDBUF = not sys.platform.startswith('linux')
+
+# Headers that only apply to a single connection and must not be forwarded
+HOP_BY_HOP_HEADERS = {'host', 'connection', 'keep-alive', 'transfer-encoding'}
+
+
+class _Flight:
+    """An upstream call in progress that other threads can wait on."""
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+_INFLIGHT = {}
+_INFLIGHT_LOCK = threading.Lock()
+
+
+def _single_flight(key, func, *args):
+    """
+    Call func(*args), unless another thread is already doing so for key; in
+    that case wait for it and share its result (or exception). Concurrent
+    cache misses for the same package thus cost one PyPI fetch, not N.
+    """
+    with _INFLIGHT_LOCK:
+        flight = _INFLIGHT.get(key)
+        is_leader = flight is None
+        if is_leader:
+            flight = _INFLIGHT[key] = _Flight()
+    
+    if not is_leader:
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+    
+    try:
+        flight.result = func(*args)
+        return flight.result
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _INFLIGHT_LOCK:
+            del _INFLIGHT[key]
+        flight.done.set()
+
+
+def _load_disk_cache(name):
+    """Load a cached entry ({'etag', 'last_modified', 'data'}), or None."""
+    try:
+        with open(CACHE_DIR / f"{name}.json", 'rb') as f:
+            return json_loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def _save_disk_cache(name, response, data):
+    """Store data along with the validators of the response it came from."""
+    entry = {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'data': data,
+    }
+    path = CACHE_DIR / f"{name}.json"
+    tmp_path = None
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(json_dumps(entry))
+        os.replace(tmp_path, path)
+    except OSError as e:
+        log.warning("  ⚠ Could not write cache entry %s: %s", name, e)
+        # Don't leave a partial temp file behind (e.g. when the disk is full)
+        if tmp_path is not None:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+
+def _revalidation_headers(cached):
+    """Conditional request headers for a cached entry, so PyPI can answer 304."""
+    headers = {}
+    if cached:
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+    return headers
+
+
+def upstream_get(path, timeout=10):
+    """
+    GET a path from PyPI and return the parsed JSON body.
+    Bodies are kept on disk and revalidated, so an unchanged document costs
+    a 304 instead of a full download, even across restarts.
+    """
+    return _single_flight(('get', path), _upstream_get, path, timeout)
+
+
+def _upstream_get(path, timeout):
+    # /pypi/<pkg>/json -> <cache>/pypi/<pkg>.json
+    cache_name = path.strip('/')
+    if cache_name.endswith('/json'):
+        cache_name = cache_name[:-len('/json')]
+    cached = _load_disk_cache(cache_name)
+    headers = {**_UPSTREAM.headers, **_revalidation_headers(cached)}
+    
+    try:
+        response = _UPSTREAM.request(
+            'GET', _UPSTREAM_PREFIX + path,
+            headers=headers, timeout=timeout, retries=_API_RETRIES,
+        )
+    except urllib3.exceptions.HTTPError as e:
+        if not cached:
+            raise
+        # PyPI is unreachable; a stale document beats falling back to stubs
+        log.warning("  ⚠ Using cached %s, PyPI unreachable: %s", path, e)
+        return cached['data']
+    if response.status == 304 and cached:
+        return cached['data']
+    if response.status >= 500 and cached:
+        log.warning("  ⚠ Using cached %s, PyPI returned HTTP %d", path, response.status)
+        return cached['data']
+    if response.status != 200:
+        raise urllib3.exceptions.HTTPError(f"HTTP {response.status} for {path}")
+    data = json_loads(response.data)
+    _save_disk_cache(cache_name, response, data)
+    return data
 
 
 def fetch_package_info(package_name):
     """Fetch package metadata from PyPI."""
     try:
-        url = f"{PYPI_INDEX}/pypi/{package_name}/json"
-        with urllib.request.urlopen(url, timeout=10) as response:
-            return json.loads(response.read())
+        return upstream_get(f"/pypi/{package_name}/json")
+    except Exception as e:
+        log.warning("  ✗ Error fetching info for %s: %s", package_name, e)
+        return None
+
+
+def _fetch_simple_json(package_name, headers=None):
+    """
+    Request the PEP 691 JSON simple index page for a package.
+    It only lists files and versions, a small fraction of /pypi/<pkg>/json.
+    """
+    project = _NORMALIZE_RE.sub('-', package_name).lower()
+    headers = {**_UPSTREAM.headers, **(headers or {}), 'Accept': SIMPLE_JSON_CONTENT_TYPE}
+    return _UPSTREAM.request(
+        'GET', f"{_UPSTREAM_PREFIX}/simple/{project}/",
+        headers=headers, timeout=10, retries=_API_RETRIES,
+    )
+
+
+def _versions_from_filenames(filenames):
+    """Recover release versions from wheel and sdist filenames."""
+    versions = set()
+    for filename in filenames:
+        if filename.endswith('.whl'):
+            # {name}-{version}(-{build})?-{python}-{abi}-{platform}.whl
+            parts = filename.split('-')
+            if len(parts) >= 5:
+                versions.add(parts[1])
+        else:
+            for ext in SDIST_EXTENSIONS:
+                if filename.endswith(ext):
+                    versions.add(filename[:-len(ext)].rpartition('-')[2])
+                    break
+    return sorted(versions)
+
+
+def fetch_release_versions(package_name):
+    """
+    Fetch the release version strings of a package from the simple index.
+    Only the version list is kept, on disk, and revalidated with
+    If-None-Match/If-Modified-Since so an unchanged package costs a 304.
+    """
+    cache_name = f"releases/{package_name}"
+    cached = _load_disk_cache(cache_name)
+    
+    try:
+        response = _fetch_simple_json(package_name, _revalidation_headers(cached))
+        if response.status == 304 and cached:
+            return cached['data']
+        if response.status != 200:
+            raise urllib3.exceptions.HTTPError(f"HTTP {response.status}")
+        content_type = response.headers.get('Content-Type', '')
+        if content_type.startswith(SIMPLE_JSON_CONTENT_TYPE):
+            page = json_loads(response.data)
+            # PEP 700 lists every release version, including file-less ones;
+            # older JSON indexes only list files
+            versions = page.get('versions')
+            if versions is None:
+                versions = _versions_from_filenames(
+                    f.get('filename', '') for f in page.get('files', []))
+        else:
+            # Index without PEP 691 support: read the PEP 503 HTML links
+            versions = _versions_from_filenames(
+                _HTML_LINK_TEXT_RE.findall(response.data.decode('utf-8', 'replace')))
     except Exception as e:
-        print(f"  ✗ Error fetching info for {package_name}: {e}")
+        log.warning("  ✗ Error fetching releases for %s: %s", package_name, e)
+        # A stale list is still better than no version at all
+        return cached['data'] if cached else None
+    
+    _save_disk_cache(cache_name, response, versions)
+    return versions
+
+
+@lru_cache(maxsize=65536)
+def _ver(version_str):
+    """Parse a version string once; invalid strings are cached as None."""
+    try:
+        return Version(version_str)
+    except InvalidVersion:
         return None
 
 
+@lru_cache(maxsize=4096)
+def _specset(specifier_str):
+    """Build (and reuse) the SpecifierSet for a specifier string."""
+    return SpecifierSet(specifier_str)
+
+
 def find_compatible_version(package_name, specifier_str=''):
     """Find a version that satisfies the specifier."""
     cache_key = f"{package_name}:{specifier_str}"
     if cache_key in VERSION_CACHE:
         return VERSION_CACHE[cache_key]
     
-    info = fetch_package_info(package_name)
-    if not info:
-        return '99.0.0'
-    
-    versions = list(info.get('releases', {}).keys())
+    versions = _single_flight(('releases', package_name), fetch_release_versions, package_name)
     if not versions:
         return '99.0.0'
     
     try:
-        parsed_versions = []
-        for v in versions:
-            try:
-                parsed_versions.append(Version(v))
-            except:
-                pass
+        # Only canonical release strings are worth handing to packaging
+        parsed_versions = [_ver(v) for v in versions if _CANON_VER.fullmatch(v)]
         
         if not parsed_versions:
             return '99.0.0'
         
-        parsed_versions.sort(reverse=True)
-        
-        if not specifier_str or specifier_str == '*':
-            for v in parsed_versions:
-                if not v.is_prerelease:
-                    result = str(v)
-                    VERSION_CACHE[cache_key] = result
-                    return result
-            result = str(parsed_versions[0])
-            VERSION_CACHE[cache_key] = result
-            return result
-        
-        spec = SpecifierSet(specifier_str)
-        for v in parsed_versions:
-            if v in spec and not v.is_prerelease:
-                result = str(v)
-                VERSION_CACHE[cache_key] = result
-                return result
-        
-        for v in parsed_versions:
-            if v in spec:
-                result = str(v)
-                VERSION_CACHE[cache_key] = result
-                return result
-        
-        result = str(parsed_versions[0])
+        spec = None
+        if specifier_str and specifier_str != '*':
+            spec = _specset(specifier_str)
+        
+        # One pass, no sort: the highest stable match, else the highest
+        # prerelease match, else the newest release overall
+        candidates = [v for v in parsed_versions if spec is None or v in spec]
+        best = (max((v for v in candidates if not v.is_prerelease), default=None)
+                or max(candidates, default=None)
+                or max(parsed_versions))
+        
+        result = str(best)
         VERSION_CACHE[cache_key] = result
         return result
         
     except Exception as e:
-        print(f"  ✗ Error parsing versions for {package_name}: {e}")
+        log.warning("  ✗ Error parsing versions for %s: %s", package_name, e)
         return '99.0.0'
 
 
+def resolve_dummy_version(package_name):
+    """Return the version served for a dummy package per DUMMY_PACKAGES."""
+    version_spec = _DUMMY_SPECS.get(package_name, '99.0.0')
+    if version_spec == 'auto':
+        version = find_compatible_version(package_name)
+        log.debug("  🤖 Auto-detected version: %s", version)
+        return version
+    return version_spec
+
+
 def get_real_package_metadata(package_name, version=None):
     """Fetch real metadata for a package from PyPI."""
     cache_key = f"meta:{package_name}:{version}"
@@ -110,12 +397,9 @@ def get_real_package_metadata(package_name, version=None):
     
     try:
         if version:
-            url = f"{PYPI_INDEX}/pypi/{package_name}/{version}/json"
+            data = upstream_get(f"/pypi/{package_name}/{version}/json")
         else:
-            url = f"{PYPI_INDEX}/pypi/{package_name}/json"
-        
-        with urllib.request.urlopen(url, timeout=10) as response:
-            data = json.loads(response.read())
+            data = upstream_get(f"/pypi/{package_name}/json")
         
         info = data.get('info', {})
         result = {
@@ -138,10 +422,24 @@ def get_real_package_metadata(package_name, version=None):
         return result
         
     except Exception as e:
-        print(f"  ⚠ Could not fetch metadata for {package_name}: {e}")
+        log.warning("  ⚠ Could not fetch metadata for %s: %s", package_name, e)
         return None
 
 
+_DESC_TEMPLATE = """\
+# {package}
+
+**This is a dummy stub package for `{package}` version {version}.**
+
+Generated by PyPI Proxy to satisfy dependency requirements without
+downloading the full package (which may be very large).
+
+## Note
+
+This package provides minimal stubs. Importing it will raise an ImportError
+explaining that the real package is not installed."""
+
+
 def generate_metadata_file(package_name, version, include_real_deps=False):
     """
     Generate proper METADATA content compliant with PEP 566/PEP 643.
@@ -149,7 +447,11 @@ def generate_metadata_file(package_name, version, include_real_deps=False):
     """
     # Try to get real metadata from PyPI
     real_meta = get_real_package_metadata(package_name, version)
-    
+    return _format_metadata(package_name, version, real_meta, include_real_deps)
+
+
+def _format_metadata(package_name, version, real_meta, include_real_deps):
+    """METADATA text from real PyPI metadata, or stub fields if it is None."""
     # Normalize package name (PEP 503: lowercase, hyphens)
     normalized_name = package_name.lower().replace('_', '-')
     
@@ -200,9 +502,9 @@ def generate_metadata_file(package_name, version, include_real_deps=False):
         if include_real_deps:
             for dep in real_meta.get('requires_dist', []):
                 # Extract base package name
-                dep_name = re.split(r'[\s\[\]<>=!;]', dep)[0].lower().replace('_', '-')
+                dep_name = _normalize_name(_DEP_SPLIT_RE.split(dep, 1)[0])
                 # Skip if it's a dummy package (we don't want real deps on dummy packages)
-                if dep_name not in DUMMY_PACKAGES:
+                if dep_name not in _DUMMY_SPECS:
                     lines.append(f"Requires-Dist: {dep}")
     else:
         # Fallback when can't fetch from PyPI
@@ -223,49 +525,60 @@ def generate_metadata_file(package_name, version, include_real_deps=False):
     lines.append("")
     
     # Description body
-    lines.append(f"# {package_name}")
-    lines.append("")
-    lines.append(f"**This is a dummy stub package for `{package_name}` version {version}.**")
-    lines.append("")
-    lines.append("Generated by PyPI Proxy to satisfy dependency requirements without")
-    lines.append("downloading the full package (which may be very large).")
-    lines.append("")
-    lines.append("## Note")
-    lines.append("")
-    lines.append("This package provides minimal stubs. Importing it will raise an ImportError")
-    lines.append("explaining that the real package is not installed.")
+    lines.append(_DESC_TEMPLATE.format(package=package_name, version=version))
     
     return "\n".join(lines)
 
 
+# hashlib.sha256 is OpenSSL's implementation, which uses the CPU's SHA
+# extensions where available
+_sha256 = hashlib.sha256
+_b64encode = base64.urlsafe_b64encode
+
+
 def file_hash_record(content):
     """Generate sha256 hash in RECORD format and file size."""
     if isinstance(content, str):
         content = content.encode('utf-8')
-    digest = hashlib.sha256(content).digest()
     # URL-safe base64 without padding
-    hash_b64 = base64.urlsafe_b64encode(digest).rstrip(b'=').decode('ascii')
+    hash_b64 = _b64encode(_sha256(content).digest()).rstrip(b'=').decode('ascii')
     return f"sha256={hash_b64}", len(content)
 
 
-def create_dummy_wheel(package_name, version, include_deps=False):
+# dist-info files identical in every dummy wheel
+_WHEEL_CONTENT_BYTES = b"""Wheel-Version: 1.0
+Generator: pypi-proxy (1.0.0)
+Root-Is-Purelib: true
+Tag: py3-none-any
+"""
+_INSTALLER_BYTES = b"uv\n"
+
+# RECORD entries for the constant files, hashed once at import
+_CONST_RECORD = {
+    _WHEEL_CONTENT_BYTES: file_hash_record(_WHEEL_CONTENT_BYTES),
+    _INSTALLER_BYTES: file_hash_record(_INSTALLER_BYTES),
+}
+
+
+@lru_cache(maxsize=1024)
+def _record_for(content):
+    """RECORD hash and size for templated file content, reused across builds."""
+    return file_hash_record(content)
+
+
+def _precompute_templates(package_name):
     """
-    Create a minimal dummy wheel package with proper METADATA.
-    The METADATA is generated using generate_metadata_file() to ensure
-    it's readable by uv, pip, and other tools.
+    Build the version-independent files of a dummy wheel for a package.
+    Returns (path_fmt, body) pairs: str bodies have {version} as their only
+    placeholder, bytes bodies are used as-is. METADATA is left out because
+    it depends on what PyPI returns.
     """
-    try:
-        print(f"  📝 Generating metadata for {package_name} {version}...")
-        
-        # Normalize package name for wheel internals (underscore)
-        wheel_name = package_name.lower().replace('-', '_')
-        dist_info_name = f"{wheel_name}-{version}.dist-info"
-        
-        # Prepare all file contents
-        files = {}
-        
-        # 1. Package __init__.py
-        init_content = f'''# -*- coding: utf-8 -*-
+    # Normalize package name for wheel internals (underscore)
+    wheel_name = package_name.lower().replace('-', '_')
+    dist_info_name = f"{wheel_name}-{{version}}.dist-info"
+    
+    # The stub uses %-formatting so its source contains no braces
+    init_content = f'''# -*- coding: utf-8 -*-
 """
 Dummy {package_name} package - stub generated by PyPI Proxy.
 
@@ -273,7 +586,7 @@ This is NOT the real {package_name} package. It's a minimal stub
 to satisfy dependency requirements without the full installation.
 """
 
-__version__ = "{version}"
+__version__ = "{{version}}"
 __author__ = "PyPI Proxy (stub)"
 __all__ = ["__version__"]
 
@@ -286,15 +599,15 @@ class _StubModule:
     
     def __getattr__(self, attr):
         raise ImportError(
-            f"Cannot import '{{attr}}' from dummy stub package '{package_name}'. "
-            f"The real '{package_name}' package is not installed. "
-            f"Install it with: pip install {package_name}"
+            "Cannot import '%s' from dummy stub package '{package_name}'. "
+            "The real '{package_name}' package is not installed. "
+            "Install it with: pip install {package_name}" % attr
         )
     
     def __call__(self, *args, **kwargs):
         raise ImportError(
-            f"Cannot call dummy stub package '{package_name}'. "
-            f"The real '{package_name}' package is not installed."
+            "Cannot call dummy stub package '{package_name}'. "
+            "The real '{package_name}' package is not installed."
         )
 
 
@@ -302,47 +615,96 @@ class _StubModule:
 def __getattr__(name):
     if name.startswith('_'):
         raise AttributeError(name)
-    return _StubModule(f"{package_name}.{{name}}")
+    return _StubModule("{package_name}." + name)
 '''
-        files[f"{wheel_name}/__init__.py"] = init_content
-        
-        # 2. METADATA - THE CRITICAL FILE
-        # Use generate_metadata_file to create proper, compliant metadata
-        metadata_content = generate_metadata_file(package_name, version, include_deps)
-        files[f"{dist_info_name}/METADATA"] = metadata_content
-        print(f"  ✓ Generated METADATA ({len(metadata_content)} bytes)")
-        
-        # 3. WHEEL file
-        wheel_content = """Wheel-Version: 1.0
-Generator: pypi-proxy (1.0.0)
-Root-Is-Purelib: true
-Tag: py3-none-any
-"""
-        files[f"{dist_info_name}/WHEEL"] = wheel_content
+    
+    # direct_url.json (optional but helps some tools); a fixed two-key
+    # object, so it is spelled out rather than built with json.dumps. Names
+    # and versions from request paths can't contain quotes or backslashes
+    # (see _WHL_NAME_RE / _WHL_VER_RE), so nothing needs escaping.
+    direct_url_content = (
+        '{{\n'
+        f'  "url": "http://localhost:8080/packages/{wheel_name}-{{version}}-py3-none-any.whl",\n'
+        '  "archive_info": {{}}\n'
+        '}}'
+    )
+    
+    return [
+        (f"{wheel_name}/__init__.py", init_content),
+        (f"{dist_info_name}/WHEEL", _WHEEL_CONTENT_BYTES),
+        (f"{dist_info_name}/top_level.txt", f"{wheel_name}\n"),
+        (f"{dist_info_name}/INSTALLER", _INSTALLER_BYTES),
+        (f"{dist_info_name}/direct_url.json", direct_url_content),
+    ]
+
+
+_WHEEL_TEMPLATES = {pkg: _precompute_templates(pkg) for pkg in _DUMMY_SPECS}
+
+
+def create_dummy_wheel(package_name, version, include_deps=False):
+    """
+    Return the bytes of a minimal dummy wheel, building it on first use.
+    Wheels are deterministic for their arguments, so builds carrying real
+    PyPI metadata are kept in WHEEL_CACHE (up to WHEEL_CACHE_MAX of them).
+    Wheels built with stub metadata because PyPI was unreachable (or the
+    version doesn't exist, e.g. the '99.0.0' fallback) are served but not
+    cached, so the next request tries again; failures return None.
+    """
+    cache_key = (package_name, version, include_deps)
+    wheel_bytes = WHEEL_CACHE.get(cache_key)
+    if wheel_bytes is None:
+        log.debug("  🔨 Building wheel: %s v%s", package_name, version)
+        wheel_bytes, has_real_meta = _single_flight(
+            ('wheel',) + cache_key,
+            _build_dummy_wheel, package_name, version, include_deps,
+        )
+        if wheel_bytes and has_real_meta:
+            with _WHEEL_CACHE_LOCK:
+                WHEEL_CACHE[cache_key] = wheel_bytes
+                while len(WHEEL_CACHE) > WHEEL_CACHE_MAX:
+                    del WHEEL_CACHE[next(iter(WHEEL_CACHE))]
+    return wheel_bytes
+
+
+def _build_dummy_wheel(package_name, version, include_deps):
+    """
+    Create a minimal dummy wheel package with proper METADATA.
+    The METADATA is generated the same way as generate_metadata_file() to
+    ensure it's readable by uv, pip, and other tools.
+    Returns (wheel_bytes, whether real PyPI metadata was used).
+    """
+    try:
+        log.debug("  📝 Generating metadata for %s %s...", package_name, version)
         
-        # 4. top_level.txt
-        top_level_content = f"{wheel_name}\n"
-        files[f"{dist_info_name}/top_level.txt"] = top_level_content
+        wheel_name = package_name.lower().replace('-', '_')
+        dist_info_name = f"{wheel_name}-{version}.dist-info"
         
-        # 5. INSTALLER
-        installer_content = "uv\n"
-        files[f"{dist_info_name}/INSTALLER"] = installer_content
+        # Static files: __init__.py, WHEEL, top_level.txt, INSTALLER,
+        # direct_url.json
+        templates = _WHEEL_TEMPLATES.get(package_name)
+        if templates is None:
+            templates = _precompute_templates(package_name)
+        files = {}
+        for path_fmt, body in templates:
+            if isinstance(body, str):
+                body = body.format(version=version)
+            files[path_fmt.format(version=version)] = body
         
-        # 6. direct_url.json (optional but helps some tools)
-        direct_url_content = json.dumps({
-            "url": f"http://localhost:8080/packages/{wheel_name}-{version}-py3-none-any.whl",
-            "archive_info": {}
-        }, indent=2)
-        files[f"{dist_info_name}/direct_url.json"] = direct_url_content
+        # METADATA - THE CRITICAL FILE
+        # Fetched here rather than in generate_metadata_file so the caller
+        # knows whether the wheel carries real or stub metadata
+        real_meta = get_real_package_metadata(package_name, version)
+        metadata_content = _format_metadata(package_name, version, real_meta, include_deps)
+        files[f"{dist_info_name}/METADATA"] = metadata_content
+        log.debug("  ✓ Generated METADATA (%d bytes)", len(metadata_content))
         
-        # 7. Build RECORD with proper hashes (must be last)
+        # Build RECORD with proper hashes (must be last)
         record_lines = []
         for filepath, content in files.items():
             if isinstance(content, str):
-                content_bytes = content.encode('utf-8')
-            else:
-                content_bytes = content
-            hash_str, size = file_hash_record(content_bytes)
+                # Encode once; the zip writer below reuses the bytes
+                content = files[filepath] = content.encode('utf-8')
+            hash_str, size = _CONST_RECORD.get(content) or _record_for(content)
             record_lines.append(f"{filepath},{hash_str},{size}")
         
         # RECORD itself has no hash (per PEP 376)
@@ -350,43 +712,32 @@ Tag: py3-none-any
         record_content = "\n".join(record_lines) + "\n"
         files[f"{dist_info_name}/RECORD"] = record_content
         
-        # Create the wheel zip file
-        temp_wheel = tempfile.NamedTemporaryFile(delete=False, suffix='.whl')
-        temp_wheel.close()
+        # Build the wheel zip in memory; the entries are a few hundred bytes
+        # of text, so storing them uncompressed is as small as deflating
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, 'w', zipfile.ZIP_STORED) as wheel:
+            for filepath, content in files.items():
+                if isinstance(content, str):
+                    content = content.encode('utf-8')
+                # Set proper file permissions in zip
+                info = zipfile.ZipInfo(filepath)
+                info.external_attr = 0o644 << 16  # rw-r--r--
+                wheel.writestr(info, content)
+        wheel_bytes = buf.getvalue()
         
-        try:
-            with zipfile.ZipFile(temp_wheel.name, 'w', zipfile.ZIP_DEFLATED) as wheel:
-                for filepath, content in files.items():
-                    if isinstance(content, str):
-                        content = content.encode('utf-8')
-                    # Set proper file permissions in zip
-                    info = zipfile.ZipInfo(filepath)
-                    info.external_attr = 0o644 << 16  # rw-r--r--
-                    wheel.writestr(info, content)
-            
-            # Read the wheel content
-            with open(temp_wheel.name, 'rb') as f:
-                wheel_bytes = f.read()
-            
-            print(f"  ✓ Created wheel: {len(files)} files, {len(wheel_bytes)} bytes")
-            
-            # Debug: list contents
-            print(f"  📦 Wheel contents:")
+        log.debug("  ✓ Created wheel: %d files, %d bytes", len(files), len(wheel_bytes))
+        
+        # Debug: list contents
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("  📦 Wheel contents:")
             for f in files.keys():
-                print(f"      - {f}")
-            
-            return wheel_bytes
-            
-        finally:
-            # Clean up temp file
-            if os.path.exists(temp_wheel.name):
-                os.unlink(temp_wheel.name)
+                log.debug("      - %s", f)
+        
+        return wheel_bytes, real_meta is not None
         
     except Exception as e:
-        print(f"  ✗ Error creating wheel: {e}")
-        import traceback
-        traceback.print_exc()
-        return None
+        log.exception("  ✗ Error creating wheel: %s", e)
+        return None, False
 
 
 def analyze_dependencies(package_name):
@@ -409,22 +760,96 @@ def analyze_dependencies(package_name):
     print("Dependencies:")
     print("-" * 60)
     
+    deps = []
     for req in requires_dist:
-        req_clean = req.split(';')[0].strip()
-        match = re.match(r'([a-zA-Z0-9\-_]+)(.*)', req_clean)
-        if match:
-            dep_name = match.group(1).lower()
-            version_spec = match.group(2).strip()
-            
-            if dep_name in DUMMY_PACKAGES:
-                if version_spec:
-                    suggested_version = find_compatible_version(dep_name, version_spec)
-                    print(f"  📦 {dep_name:30} {version_spec:20} → {suggested_version}")
-                else:
-                    print(f"  📦 {dep_name:30} (any version)")
+        try:
+            requirement = Requirement(req)
+        except InvalidRequirement:
+            continue
+        # Skip deps whose markers exclude this environment (e.g. other
+        # Python versions or unselected extras) instead of resolving them
+        if requirement.marker and not requirement.marker.evaluate():
+            continue
+        
+        dep_name = _normalize_name(requirement.name)
+        if dep_name in _DUMMY_SPECS:
+            deps.append((dep_name, str(requirement.specifier)))
+    
+    def resolve(dep):
+        dep_name, version_spec = dep
+        return find_compatible_version(dep_name, version_spec) if version_spec else None
+    
+    # Each lookup blocks on a PyPI round trip, so run them concurrently
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        suggestions = list(executor.map(resolve, deps))
+    
+    for (dep_name, version_spec), suggested_version in zip(deps, suggestions):
+        if version_spec:
+            print(f"  📦 {dep_name:30} {version_spec:20} → {suggested_version}")
+        else:
+            print(f"  📦 {dep_name:30} (any version)")
+
+
+@lru_cache(maxsize=256)
+def _build_simple_page(package_name, version):
+    """
+    Render the simple index page for a dummy package.
+    Returns the encoded HTML and the versions it links to; the page only
+    depends on the arguments, so repeat requests reuse the cached bytes.
+    """
+    # Use underscore for wheel filename (PEP 427)
+    wheel_name = package_name.replace('-', '_')
+    
+    # Serve multiple versions for compatibility
+    versions_to_serve = [version]
+    v = _ver(version)
+    if v is not None:
+        if v.minor > 0:
+            older1 = f"{v.major}.{v.minor - 1}.0"
+            versions_to_serve.append(older1)
+        if v.minor > 1:
+            older2 = f"{v.major}.{v.minor - 2}.0"
+            versions_to_serve.append(older2)
+    
+    links = []
+    for ver in versions_to_serve:
+        fname = f"{wheel_name}-{ver}-py3-none-any.whl"
+        links.append(
+            f'    <a href="/packages/{fname}" data-requires-python="&gt;=3.8">{fname}</a><br/>'
+        )
+    
+    html = f"""<!DOCTYPE html>
+<html>
+  <head>
+    <meta charset="utf-8">
+    <title>Links for {package_name}</title>
+  </head>
+  <body>
+    <h1>Links for {package_name}</h1>
+{chr(10).join(links)}
+  </body>
+</html>
+"""
+    
+    return html.encode('utf-8'), tuple(versions_to_serve)
 
 
 class PyPIProxyHandler(BaseHTTPRequestHandler):
+    # Headers and small simple pages go out as separate writes; with Nagle
+    # on they can sit behind a delayed ACK before the client sees them
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        if _TUNE_SNDBUF:
+            # Only ever raise the buffer; never shrink a larger default
+            try:
+                sock = self.connection
+                if sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF) < SOCKET_SNDBUF:
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_SNDBUF)
+            except OSError:
+                pass
+
     def log_message(self, format, *args):
         pass
 
@@ -432,16 +857,11 @@ class PyPIProxyHandler(BaseHTTPRequestHandler):
         path = self.path
         package_name = self._extract_package_name(path)
         
-        if package_name and package_name in DUMMY_PACKAGES:
+        if package_name in _DUMMY_SPECS:
             if '/simple/' in path:
-                self.send_response(200)
-                self.send_header('Content-Type', 'text/html; charset=utf-8')
-                self.end_headers()
+                self._serve_dummy_simple_page(package_name, send_body=False)
             elif path.endswith('.whl') or path.endswith('.tar.gz'):
-                self.send_response(200)
-                self.send_header('Content-Type', 'application/octet-stream')
-                self.send_header('Content-Length', '10000')
-                self.end_headers()
+                self._serve_dummy_package(package_name, send_body=False)
             else:
                 self._proxy_request_head()
         else:
@@ -451,15 +871,15 @@ class PyPIProxyHandler(BaseHTTPRequestHandler):
         path = self.path
         package_name = self._extract_package_name(path)
         
-        print(f"\n{'='*60}")
-        print(f"📍 REQUEST: {path}")
+        log.debug("\n%s", '=' * 60)
+        log.debug("📍 REQUEST: %s", path)
+        is_dummy = package_name in _DUMMY_SPECS
         if package_name:
-            is_dummy = package_name in DUMMY_PACKAGES
-            print(f"   Package: {package_name}")
-            print(f"   Is Dummy: {is_dummy}")
+            log.debug("   Package: %s", package_name)
+            log.debug("   Is Dummy: %s", is_dummy)
         
-        if package_name and package_name in DUMMY_PACKAGES:
-            print(f"📦 Handling as DUMMY package")
+        if is_dummy:
+            log.debug("📦 Handling as DUMMY package")
             if '/simple/' in path:
                 self._serve_dummy_simple_page(package_name)
             elif path.endswith('.whl') or path.endswith('.tar.gz'):
@@ -468,102 +888,52 @@ class PyPIProxyHandler(BaseHTTPRequestHandler):
                 self._proxy_request()
         else:
             if package_name:
-                print(f"🌐 Proxying to PyPI")
+                log.debug("🌐 Proxying to PyPI")
             self._proxy_request()
 
     def _extract_package_name(self, path):
         """Extract and normalize package name from request path."""
-        if '/simple/' in path:
-            parts = path.split('/simple/')
-            if len(parts) > 1:
-                name = parts[1].rstrip('/').split('/')[0]
+        if path.startswith('/simple/'):
+            end = path.find('/', 8)
+            name = path[8:end] if end != -1 else path[8:]
+            if name:
                 # Normalize: lowercase, replace underscores with hyphens (PEP 503)
-                return name.lower().replace('_', '-')
-        elif '/packages/' in path:
-            filename = os.path.basename(path)
-            # Match package name before version number
-            match = re.match(r'^([a-zA-Z0-9_-]+)-\d', filename)
+                return _normalize_name(name)
+        elif path.startswith('/packages/'):
+            # Match package name before version number in the filename
+            match = _WHL_NAME_RE.match(path, path.rfind('/') + 1)
             if match:
-                name = match.group(1)
-                return name.lower().replace('_', '-')
+                return _normalize_name(match.group(1))
         return None
 
-    def _serve_dummy_simple_page(self, package_name):
-        """Serve the simple index page for a dummy package."""
-        version_spec = DUMMY_PACKAGES.get(package_name, '99.0.0')
-        
-        if version_spec == 'auto':
-            version = find_compatible_version(package_name)
-            print(f"  🤖 Auto-detected version: {version}")
-        else:
-            version = version_spec
-        
-        # Use underscore for wheel filename (PEP 427)
-        wheel_name = package_name.replace('-', '_')
-        
-        # Serve multiple versions for compatibility
-        versions_to_serve = [version]
-        try:
-            v = Version(version)
-            if v.minor > 0:
-                older1 = f"{v.major}.{v.minor - 1}.0"
-                versions_to_serve.append(older1)
-            if v.minor > 1:
-                older2 = f"{v.major}.{v.minor - 2}.0"
-                versions_to_serve.append(older2)
-        except:
-            pass
-        
-        links = []
-        for ver in versions_to_serve:
-            fname = f"{wheel_name}-{ver}-py3-none-any.whl"
-            links.append(
-                f'    <a href="/packages/{fname}" data-requires-python="&gt;=3.8">{fname}</a><br/>'
-            )
-        
-        html = f"""<!DOCTYPE html>
-<html>
-  <head>
-    <meta charset="utf-8">
-    <title>Links for {package_name}</title>
-  </head>
-  <body>
-    <h1>Links for {package_name}</h1>
-{chr(10).join(links)}
-  </body>
-</html>
-"""
-        
-        content = html.encode('utf-8')
+    def _serve_dummy_simple_page(self, package_name, send_body=True):
+        """Serve the simple index page (or just its headers) for a dummy package."""
+        version = resolve_dummy_version(package_name)
+        content, versions_to_serve = _build_simple_page(package_name, version)
         self.send_response(200)
         self.send_header('Content-Type', 'text/html; charset=utf-8')
         self.send_header('Content-Length', len(content))
         self.send_header('Cache-Control', 'no-cache')
         self.end_headers()
-        self.wfile.write(content)
-        print(f"  ✓ Served simple page: {package_name}")
-        print(f"    Versions: {', '.join(versions_to_serve)}")
+        if send_body:
+            self.wfile.write(content)
+            log.debug("  ✓ Served simple page: %s", package_name)
+            log.debug("    Versions: %s", ', '.join(versions_to_serve))
 
-    def _serve_dummy_package(self, package_name):
-        """Serve the actual dummy wheel file."""
+    def _serve_dummy_package(self, package_name, send_body=True):
+        """Serve the actual dummy wheel file (or just its headers)."""
         filename = os.path.basename(self.path)
         
         # Extract version from filename
         # Format: {name}-{version}-py3-none-any.whl
-        version_match = re.search(r'-(\d+\.\d+\.\d+(?:\.\w+)?)-', filename)
+        version_match = _WHL_VER_RE.search(filename)
         
         if version_match:
             version = version_match.group(1)
         else:
-            version_spec = DUMMY_PACKAGES.get(package_name, '99.0.0')
-            if version_spec == 'auto':
-                version = find_compatible_version(package_name)
-            else:
-                version = version_spec
-        
-        print(f"  🔨 Building wheel: {package_name} v{version}")
+            version = resolve_dummy_version(package_name)
         
-        # Create the wheel with proper METADATA
+        # Built once per version, then served from WHEEL_CACHE
         content = create_dummy_wheel(package_name, version, include_deps=False)
         
         if content:
@@ -573,53 +943,93 @@ class PyPIProxyHandler(BaseHTTPRequestHandler):
             self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
             self.send_header('Cache-Control', 'no-cache')
             self.end_headers()
-            self.wfile.write(content)
-            print(f"  ✓ Served wheel: {filename} ({len(content)} bytes)")
+            if send_body:
+                self.wfile.write(content)
+                log.debug("  ✓ Served wheel: %s (%d bytes)", filename, len(content))
         else:
             self.send_error(500, "Failed to build dummy package")
-            print(f"  ✗ Failed to build wheel")
+            log.error("  ✗ Failed to build wheel")
+
+    def _upstream_headers(self):
+        """Client request headers minus the hop-by-hop ones."""
+        headers = dict(_UPSTREAM.headers)
+        for key, value in self.headers.items():
+            if key.lower() not in HOP_BY_HOP_HEADERS:
+                headers[key] = value
+        return headers
+
+    def _send_upstream_headers(self, response):
+        self.send_response(response.status)
+        for key, value in response.headers.items():
+            if key.lower() not in HOP_BY_HOP_HEADERS:
+                self.send_header(key, value)
+        self.end_headers()
 
     def _proxy_request_head(self):
-        url = f"{PYPI_INDEX}{self.path}"
         try:
-            req = urllib.request.Request(url, method='HEAD')
-            req.add_header('User-Agent', 'pypi-proxy/1.0')
-            with urllib.request.urlopen(req, timeout=30) as response:
-                self.send_response(response.status)
-                for key, value in response.headers.items():
-                    if key.lower() not in ['transfer-encoding', 'connection']:
-                        self.send_header(key, value)
-                self.end_headers()
-        except urllib.error.HTTPError as e:
-            self.send_error(e.code, e.reason)
+            response = _UPSTREAM.urlopen(
+                'HEAD', _UPSTREAM_PREFIX + self.path,
+                headers=self._upstream_headers(), timeout=30,
+                preload_content=False, redirect=False,
+            )
+            try:
+                self._send_upstream_headers(response)
+            finally:
+                response.release_conn()
         except Exception as e:
             self.send_error(502, f"Proxy error: {str(e)}")
 
     def _proxy_request(self):
-        url = f"{PYPI_INDEX}{self.path}"
         try:
-            headers = {'User-Agent': 'pypi-proxy/1.0'}
-            for key, value in self.headers.items():
-                if key.lower() not in ['host', 'connection']:
-                    headers[key] = value
-            
-            req = urllib.request.Request(url, headers=headers)
-            with urllib.request.urlopen(req, timeout=30) as response:
-                self.send_response(response.status)
-                for key, value in response.headers.items():
-                    if key.lower() not in ['transfer-encoding', 'connection']:
-                        self.send_header(key, value)
-                self.end_headers()
-                shutil.copyfileobj(response, self.wfile)
-        except urllib.error.HTTPError as e:
-            self.send_error(e.code, e.reason)
+            response = _UPSTREAM.urlopen(
+                'GET', _UPSTREAM_PREFIX + self.path,
+                headers=self._upstream_headers(), timeout=30,
+                preload_content=False, decode_content=False, redirect=False,
+            )
+            try:
+                self._send_upstream_headers(response)
+                shutil.copyfileobj(response, self.wfile, PROXY_COPY_BUFSIZE)
+            finally:
+                response.release_conn()
         except Exception as e:
             self.send_error(502, f"Proxy error: {str(e)}")
 
 
+class PyPIProxyServer(ThreadingHTTPServer):
+    """
+    One thread per connection so a slow upstream download doesn't block the
+    installer's other requests.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+    # uv opens many connections at once; the default backlog of 5 drops some
+    request_queue_size = 64
+
+
+def _prewarm_package(package_name):
+    version = resolve_dummy_version(package_name)
+    _build_simple_page(package_name, version)
+    create_dummy_wheel(package_name, version, include_deps=False)
+
+
+def prewarm_caches():
+    """
+    Resolve and build every dummy package before clients ask for it, so the
+    first requests are served from VERSION_CACHE, the page cache and
+    WHEEL_CACHE. Each package is warmed in its own daemon thread, so their
+    PyPI round trips overlap and a slow PyPI never holds up shutdown (an
+    executor's workers would be joined at exit). Returns immediately.
+    """
+    for package_name in _DUMMY_SPECS:
+        threading.Thread(target=_prewarm_package, args=(package_name,), daemon=True).start()
+
+
 def run_server(port=8080):
     server_address = ('', port)
-    httpd = HTTPServer(server_address, PyPIProxyHandler)
+    httpd = PyPIProxyServer(server_address, PyPIProxyHandler)
+    
+    # Warm the caches in the background so startup isn't blocked on PyPI
+    prewarm_caches()
     
     print(f"""
 ╔══════════════════════════════════════════════════════════════════╗
@@ -657,6 +1067,12 @@ Press Ctrl+C to stop.
 
 
 if __name__ == '__main__':
+    logging.basicConfig(format='%(message)s', stream=sys.stdout)
+    if '--verbose' in sys.argv:
+        # Trace every request, not just problems
+        sys.argv.remove('--verbose')
+        log.setLevel(logging.DEBUG)
+    
     if len(sys.argv) > 1:
         if sys.argv[1] == '--analyze' and len(sys.argv) > 2:
             analyze_dependencies(sys.argv[2])
@@ -694,5 +1110,6 @@ if __name__ == '__main__':
             print("  python pypi_proxy.py --analyze PACKAGE  # Analyze dependencies")
             print("  python pypi_proxy.py --test-wheel [PKG] [VER]  # Test wheel generation")
             print("  python pypi_proxy.py --test-metadata [PKG] [VER]  # Test metadata")
+            print("  python pypi_proxy.py --verbose          # Run server, log every request")
     else:
         run_server()